@@ -0,0 +1,185 @@
+from PIL import ImageCms, ImageWin, ExifTags
+import io
+import hashlib
+import threading
+
+# Profile and transform caches live for the life of the process. Building an
+# ICC transform is far more expensive than applying one to a slot-sized tile,
+# so each (source profile, destination profile, mode) combination is only
+# built once and then reused for every photo and every print.
+_profile_cache = {}
+_transform_cache = {}
+_cache_lock = threading.Lock()
+
+SRGB_KEY = "sRGB"
+
+# EXIF tags used to spot Adobe RGB photos that carry no embedded ICC profile
+EXIF_COLOR_SPACE = 0xA001       # 1 = sRGB, 0xFFFF = uncalibrated
+EXIF_INTEROP_INDEX = 0x0001     # "R98" = sRGB, "R03" = Adobe RGB
+
+# Modes that can be fed straight into an ICC transform
+SUPPORTED_INPUT_MODES = ("RGB", "CMYK", "L")
+
+
+def _get_srgb_profile():
+    """Return the built-in sRGB profile, creating it on first use"""
+    with _cache_lock:
+        profile = _profile_cache.get(SRGB_KEY)
+        if profile is None:
+            profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB"))
+            _profile_cache[SRGB_KEY] = profile
+        return profile
+
+
+def get_srgb_profile_bytes():
+    """Return the sRGB profile as bytes, for embedding in saved JPEGs"""
+    return _get_srgb_profile().tobytes()
+
+
+def load_profile_bytes(profile_bytes):
+    """Return (cache key, profile) for raw ICC bytes, e.g. an embedded JPEG profile"""
+    key = hashlib.sha1(profile_bytes).hexdigest()
+    with _cache_lock:
+        profile = _profile_cache.get(key)
+        if profile is None:
+            profile = ImageCms.ImageCmsProfile(io.BytesIO(profile_bytes))
+            _profile_cache[key] = profile
+        return key, profile
+
+
+def load_profile_file(profile_path):
+    """Return (cache key, profile) for an ICC file on disk"""
+    key = "file:" + profile_path
+    with _cache_lock:
+        profile = _profile_cache.get(key)
+        if profile is None:
+            profile = ImageCms.ImageCmsProfile(profile_path)
+            _profile_cache[key] = profile
+        return key, profile
+
+
+def is_srgb_profile(profile):
+    """Check whether a profile is just sRGB (e.g. Windows' default "sRGB IEC61966-2.1")"""
+    try:
+        description = profile.profile.profile_description or ""
+        return description.strip().lower().startswith("srgb")
+    except Exception:
+        return False
+
+
+def get_printer_profile(printer_name, hdc_handle, profile_path=None):
+    """Return (cache key, profile) for a printer, or (None, None) if it has none
+
+    An explicit ICC file wins; otherwise the profile Windows has associated
+    with the printer DC is used. Windows hands back its default sRGB profile
+    when the printer has none associated; that is treated as no profile, as
+    converting sRGB to sRGB would be a no-op. Found profiles are cached per
+    printer; failed lookups are not, so the next print tries again.
+    """
+    if profile_path:
+        return load_profile_file(profile_path)
+
+    key = "printer:" + printer_name
+    with _cache_lock:
+        if key in _profile_cache:
+            return key, _profile_cache[key]
+
+    try:
+        # Pillow only treats the handle as a DC when wrapped in ImageWin.HDC;
+        # a bare int is taken to be a window handle
+        profile = ImageCms.get_display_profile(ImageWin.HDC(hdc_handle))
+    except Exception as e:
+        print(f"Could not read ICC profile for printer {printer_name}: {str(e)}")
+        profile = None
+
+    if profile is None:
+        return None, None
+
+    if is_srgb_profile(profile):
+        print(f"Printer {printer_name} has no ICC profile of its own (system default sRGB), skipping conversion")
+        return None, None
+
+    with _cache_lock:
+        _profile_cache[key] = profile
+    return key, profile
+
+
+def is_adobe_rgb(image):
+    """Check the EXIF color space tags for an untagged Adobe RGB photo"""
+    try:
+        # ColorSpace lives in the Exif sub-IFD, not IFD0
+        exif = image.getexif()
+        if exif.get_ifd(ExifTags.IFD.Exif).get(EXIF_COLOR_SPACE) != 0xFFFF:
+            return False
+        interop = exif.get_ifd(ExifTags.IFD.Interop)
+        return str(interop.get(EXIF_INTEROP_INDEX, "")).strip() == "R03"
+    except Exception:
+        return False
+
+
+def get_source_profile(image, adobe_rgb_profile_path=None):
+    """Work out the color profile of a photo straight after Image.open
+
+    Returns (cache key, profile), or (None, None) if the photo should be
+    treated as sRGB already. Must be called before the image is resized,
+    while the embedded profile and EXIF data are still attached.
+    """
+    profile_bytes = image.info.get("icc_profile")
+    if profile_bytes:
+        return load_profile_bytes(profile_bytes)
+
+    if adobe_rgb_profile_path and is_adobe_rgb(image):
+        return load_profile_file(adobe_rgb_profile_path)
+
+    return None, None
+
+
+def get_transform(source_key, source_profile, dest_key, dest_profile, in_mode, out_mode="RGB",
+                  intent=ImageCms.Intent.PERCEPTUAL):
+    """Return a cached transform for this profile pair, building it on first use"""
+    cache_key = (source_key, dest_key, in_mode, out_mode, intent)
+    with _cache_lock:
+        transform = _transform_cache.get(cache_key)
+        if transform is None:
+            transform = ImageCms.buildTransform(source_profile, dest_profile, in_mode, out_mode,
+                                                renderingIntent=intent)
+            _transform_cache[cache_key] = transform
+        return transform
+
+
+def convert_to_srgb(image, source_key, source_profile):
+    """Convert a (slot-sized) tile from its source profile to sRGB
+
+    Falls back to a plain mode conversion if there is no profile or the
+    transform cannot be built, so a bad profile never drops a photo.
+    """
+    if source_profile is None or image.mode not in SUPPORTED_INPUT_MODES:
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    try:
+        transform = get_transform(source_key, source_profile, SRGB_KEY, _get_srgb_profile(), image.mode)
+        return ImageCms.applyTransform(image, transform)
+    except Exception as e:
+        print(f"Color conversion to sRGB failed, using unconverted photo: {str(e)}")
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def convert_to_printer(image, printer_key, printer_profile, source_key=None, source_profile=None):
+    """Convert an sRGB (or tagged) image to the printer's profile
+
+    Returns the image unchanged if no printer profile is available.
+    """
+    if printer_profile is None:
+        return image
+
+    if source_profile is None:
+        source_key, source_profile = SRGB_KEY, _get_srgb_profile()
+    if image.mode not in SUPPORTED_INPUT_MODES:
+        image = image.convert("RGB")
+
+    try:
+        transform = get_transform(source_key, source_profile, printer_key, printer_profile, image.mode)
+        return ImageCms.applyTransform(image, transform)
+    except Exception as e:
+        print(f"Color conversion to printer profile failed, printing unconverted: {str(e)}")
+        return image
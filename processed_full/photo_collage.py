@@ -1,17 +1,37 @@
-from PIL import Image
+from PIL import Image, ExifTags
+import io
 import os
+import shutil
 from datetime import datetime
 import glob
 import time
+import color_management
+from quality_controller import QUALITY_TIERS
 
 class CollageCreator:
-    def __init__(self, input_files=None):
+    # Downscaled templates for previews, shared across instances so the PNG is
+    # only decoded and resized once per process
+    _preview_template_cache = {}
+
+    def __init__(self, input_files=None, quality_tier=None):
         self.template_path = r"C:\Users\junha\OneDrive - University of Southampton\media\media\template\template1.png"
         self.input_dir = r"C:\Users\junha\OneDrive - University of Southampton\media\media\processed_full"
         self.output_dir = r"C:\Users\junha\OneDrive - University of Southampton\media\media\merged_images"
         self.input_files = input_files
+        # Resample filter, decode draft scale and JPEG settings (see quality_controller)
+        self.quality_tier = quality_tier if quality_tier is not None else QUALITY_TIERS[0]
         os.makedirs(self.output_dir, exist_ok=True)
         
+        # Always holds the newest collage: the low-res preview first, then the
+        # full-quality render once it is done (point a viewer/slideshow at this)
+        self.display_path = os.path.join(self.output_dir, "latest_collage.jpg")
+        self.preview_quality = 70
+        self.preview_scale = 0.5  # Preview is rendered at this fraction of full size
+        
+        # Optional Adobe RGB ICC file, used for photos tagged Adobe RGB in EXIF
+        # but shipped without an embedded profile (None = treat them as sRGB)
+        self.adobe_rgb_profile_path = None
+        
         # Template photo positions (x, y, width, height) - Updated to match detected transparent areas
         self.photo_positions = [
             (98, 333, 885, 639),    # Top photo - exact match to detected transparent area
@@ -141,6 +161,39 @@ class CollageCreator:
         
         raise Exception(f"Could not retrieve enough valid photos after {max_attempts} attempts.")
 
+    def fit_photo_to_slot(self, photo, target_size, resample):
+        """Scale a photo to fill the target size, then center-crop it to fit exactly"""
+        target_width, target_height = target_size
+        
+        # Calculate scaling factor to fill the entire area exactly
+        width_ratio = target_width / photo.width
+        height_ratio = target_height / photo.height
+        
+        # Use the larger ratio to ensure the photo fills the entire area
+        scale_factor = max(width_ratio, height_ratio)
+        
+        # Calculate new dimensions
+        new_width = int(photo.width * scale_factor)
+        new_height = int(photo.height * scale_factor)
+        
+        # Resize the photo
+        photo = photo.resize((new_width, new_height), resample)
+        
+        # Calculate crop offsets to center the image
+        left = (new_width - target_width) // 2
+        top = (new_height - target_height) // 2
+        right = left + target_width
+        bottom = top + target_height
+        
+        # Crop to exact target size to match transparent area exactly
+        photo = photo.crop((left, top, right, bottom))
+        
+        # Ensure the cropped photo is exactly the target size
+        if photo.size != (target_width, target_height):
+            photo = photo.resize((target_width, target_height), resample)
+        
+        return photo
+
     def create_collage(self, photos):
         """Create a collage using the template and provided photos"""
         template = Image.open(self.template_path)
@@ -150,36 +203,20 @@ class CollageCreator:
                 # Load the photo
                 photo = Image.open(photo_path)
                 
-                # Get target width and height from position
-                target_width = position[2]
-                target_height = position[3]
-                
-                # Calculate scaling factor to fill the entire area exactly
-                width_ratio = target_width / photo.width
-                height_ratio = target_height / photo.height
-                
-                # Use the larger ratio to ensure the photo fills the entire area
-                scale_factor = max(width_ratio, height_ratio)
-                
-                # Calculate new dimensions
-                new_width = int(photo.width * scale_factor)
-                new_height = int(photo.height * scale_factor)
+                # Read the color profile now, before resizing, while the embedded
+                # ICC data and EXIF tags are still attached to the photo
+                profile_key, profile = color_management.get_source_profile(photo, self.adobe_rgb_profile_path)
                 
-                # Resize the photo
-                photo = photo.resize((new_width, new_height), Image.LANCZOS)
+                # Under load, let the JPEG decoder downscale (never below the slot size)
+                draft_scale = self.quality_tier['draft_scale']
+                if draft_scale:
+                    photo.draft('RGB', (position[2] * draft_scale, position[3] * draft_scale))
                 
-                # Calculate crop offsets to center the image
-                left = (new_width - target_width) // 2
-                top = (new_height - target_height) // 2
-                right = left + target_width
-                bottom = top + target_height
+                # Scale and crop the photo to fill its slot exactly
+                photo = self.fit_photo_to_slot(photo, (position[2], position[3]), self.quality_tier['resample'])
                 
-                # Crop to exact target size to match transparent area exactly
-                photo = photo.crop((left, top, right, bottom))
-                
-                # Ensure the cropped photo is exactly the target size
-                if photo.size != (target_width, target_height):
-                    photo = photo.resize((target_width, target_height), Image.LANCZOS)
+                # Convert the slot-sized tile to sRGB (much cheaper than the full decode)
+                photo = color_management.convert_to_srgb(photo, profile_key, profile)
                 
                 # Paste the photo directly onto the template at exact position
                 template.paste(photo, (position[0], position[1]))
@@ -192,6 +229,119 @@ class CollageCreator:
         
         return template
 
+    def open_preview_photo(self, photo_path, target_size):
+        """Open a low-res version of a photo without decoding the full image
+
+        Tries, in order: the large preview JPEG camera MPO files carry as a
+        second frame, the EXIF thumbnail in IFD1 if it is at least the target
+        size, and finally a draft-scale
+        (DCT-downscaled) decode of the main image.
+        """
+        photo = Image.open(photo_path)
+        
+        # Sony and other cameras store a ~1616x1080 preview as an MPF frame
+        try:
+            if getattr(photo, "n_frames", 1) > 1:
+                full_size = photo.size
+                photo.seek(1)
+                if photo.width < full_size[0]:
+                    photo.draft('RGB', target_size)
+                    photo.load()
+                    return photo
+                photo.seek(0)
+        except Exception as e:
+            print(f"Could not read MPF preview from {photo_path}: {str(e)}")
+            photo = Image.open(photo_path)
+        
+        # EXIF thumbnail: offsets in IFD1 are relative to the TIFF header,
+        # which starts after the 6-byte "Exif\0\0" prefix
+        try:
+            exif_bytes = photo.info.get("exif")
+            if exif_bytes:
+                ifd1 = photo.getexif().get_ifd(ExifTags.IFD.IFD1)
+                offset = ifd1.get(0x0201)   # JPEGInterchangeFormat
+                length = ifd1.get(0x0202)   # JPEGInterchangeFormatLength
+                if offset and length:
+                    start = 6 + offset
+                    thumbnail = Image.open(io.BytesIO(exif_bytes[start:start + length]))
+                    # Camera thumbnails are usually ~160x120 (often letterboxed);
+                    # only use one that is big enough not to need upscaling
+                    if thumbnail.width >= target_size[0] and thumbnail.height >= target_size[1]:
+                        thumbnail.load()
+                        return thumbnail
+        except Exception as e:
+            print(f"Could not read EXIF thumbnail from {photo_path}: {str(e)}")
+        
+        # Fall back to a draft decode at the closest DCT scale above the slot size
+        photo.draft('RGB', target_size)
+        return photo
+
+    def get_preview_template(self):
+        """Return a copy of the template scaled down by preview_scale (cached)"""
+        cache_key = (self.template_path, self.preview_scale)
+        template = CollageCreator._preview_template_cache.get(cache_key)
+        if template is None:
+            template = Image.open(self.template_path)
+            preview_size = (int(template.width * self.preview_scale), int(template.height * self.preview_scale))
+            template = template.resize(preview_size, Image.BILINEAR)
+            CollageCreator._preview_template_cache[cache_key] = template
+        return template.copy()
+
+    def create_preview_collage(self, photos):
+        """Quickly composite a low-res collage from embedded photo previews"""
+        template = self.get_preview_template()
+        
+        for photo_path, position in zip(photos, self.photo_positions):
+            # Scale the slot to match the downscaled template
+            position = tuple(int(v * self.preview_scale) for v in position)
+            target_size = (position[2], position[3])
+            try:
+                photo = self.open_preview_photo(photo_path, target_size)
+                photo = self.fit_photo_to_slot(photo, target_size, Image.BILINEAR)
+                if photo.mode != 'RGB':
+                    photo = photo.convert('RGB')
+                template.paste(photo, (position[0], position[1]))
+            except Exception as e:
+                print(f"Error creating preview for {photo_path}: {str(e)}")
+                placeholder = Image.new('RGB', target_size, (200, 200, 200))
+                template.paste(placeholder, (position[0], position[1]))
+        
+        return template
+
+    def make_side_by_side(self, collage):
+        """Place two copies of the collage next to each other"""
+        total_width = collage.width * 2
+        final_image = Image.new('RGB', (total_width, collage.height))
+        final_image.paste(collage, (0, 0))
+        final_image.paste(collage, (collage.width, 0))
+        return final_image
+
+    def create_preview(self, photos=None):
+        """Write a low-res side-by-side preview to display_path and return the path
+
+        Should be called before create_side_by_side_collage, which moves the
+        source photos away once the full render is saved.
+        """
+        if photos is None:
+            photos = self.get_latest_photos(3)
+        
+        preview = self.make_side_by_side(self.create_preview_collage(photos))
+        
+        # Write to a temporary file first so a viewer never sees a half-written image
+        temp_path = self.display_path + ".tmp"
+        preview.save(temp_path, "JPEG", quality=self.preview_quality)
+        os.replace(temp_path, self.display_path)
+        return self.display_path
+
+    def publish_to_display(self, output_path):
+        """Replace the preview at display_path with the finished collage"""
+        try:
+            temp_path = self.display_path + ".tmp"
+            shutil.copyfile(output_path, temp_path)
+            os.replace(temp_path, self.display_path)
+        except Exception as e:
+            print(f"Error updating display image {self.display_path}: {str(e)}")
+
     def create_side_by_side_collage(self):
         """Create the final side-by-side collage and move used photos to prevent reuse"""
         recent_photos = self.get_latest_photos(3)
@@ -206,17 +356,16 @@ class CollageCreator:
         collage = self.create_collage(recent_photos)
         
         # Create the side-by-side image
-        total_width = collage.width * 2
-        final_image = Image.new('RGB', (total_width, collage.height))
-        
-        # Paste the collage twice side by side
-        final_image.paste(collage, (0, 0))
-        final_image.paste(collage, (collage.width, 0))
+        final_image = self.make_side_by_side(collage)
         
         # Save the collage and get the path
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = os.path.join(self.output_dir, f"collage_{timestamp}.jpg")
-        final_image.save(output_path)
+        final_image.save(output_path, icc_profile=color_management.get_srgb_profile_bytes(),
+                         quality=self.quality_tier['quality'], subsampling=self.quality_tier['subsampling'])
+        
+        # Swap the full-quality collage in over the preview
+        self.publish_to_display(output_path)
         
         # Move the used images to the used_images directory to prevent reuse
         for photo_path in recent_photos:
@@ -243,6 +392,14 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "--check-template":
         print("Checking template positioning...")
         creator.find_transparent_areas()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--preview":
+        try:
+            preview_path = creator.create_preview()
+            print(f"Created preview: {preview_path}")
+            output_path = creator.create_side_by_side_collage()
+            print(f"Created collage: {output_path}")
+        except Exception as e:
+            print(f"Error creating collage: {str(e)}")
     else:
         try:
             output_path = creator.create_side_by_side_collage()
@@ -5,6 +5,8 @@ import time
 from datetime import datetime
 import traceback
 from photo_collage import CollageCreator
+import color_management
+from quality_controller import QualityController
 from PIL import Image, ImageWin
 import win32print
 import win32ui
@@ -19,6 +21,18 @@ class PhotoboothHandler(FileSystemEventHandler):
         self.new_files = []
         self.copies = copies
         
+        # Optional printer ICC file; if None, the profile Windows associates
+        # with the default printer is used (no conversion if it has none)
+        self.printer_profile_path = None
+        
+        # Show a low-res preview (from embedded camera previews) while the
+        # full-quality collage renders in the background
+        self.show_preview = True
+        
+        # Drops render/print quality (down to a print-quality floor) while a
+        # backlog builds up, and returns to full quality once it clears
+        self.quality_controller = QualityController(latency_target=20.0)
+        
         # Initialize print queue system
         self.print_queue = queue.Queue()
         self.print_thread = threading.Thread(target=self._print_worker, daemon=True)
@@ -34,10 +48,10 @@ class PhotoboothHandler(FileSystemEventHandler):
     def _get_timestamp(self):
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    def get_copies_for_collage(self):
+    def get_copies_for_collage(self, banner="COLLAGE READY!"):
         """Ask user how many copies to print for this specific collage"""
         print(f"\n{'-'*50}")
-        print(f"[{self._get_timestamp()}] COLLAGE READY!")
+        print(f"[{self._get_timestamp()}] {banner}")
         print(f"{'-'*50}")
         
         while True:
@@ -70,16 +84,17 @@ class PhotoboothHandler(FileSystemEventHandler):
                 if print_job is None:  # Shutdown signal
                     break
                     
-                image_path, copies = print_job
+                image_path, copies, quality_tier = print_job
                 self.is_printing = True
                 
                 print(f"[{self._get_timestamp()}] Starting print job: {os.path.basename(image_path)} ({copies} copies)")
+                job_start = time.perf_counter()
                 
                 # Send to printer
                 for copy_num in range(copies):
                     try:
                         # Print the image using the existing print_image_direct method
-                        self.print_image_direct(image_path)
+                        self.print_image_direct(image_path, quality_tier)
                         print(f"[{self._get_timestamp()}] Sent copy {copy_num + 1}/{copies} to printer")
                         
                         # Small delay between copies to prevent overwhelming printer
@@ -89,6 +104,9 @@ class PhotoboothHandler(FileSystemEventHandler):
                     except Exception as e:
                         print(f"[{self._get_timestamp()}] Error printing copy {copy_num + 1}: {e}")
                 
+                # Record the whole job (all copies), since the backlog is counted in jobs
+                self.quality_controller.record_latency('print', time.perf_counter() - job_start)
+                
                 self.is_printing = False
                 print(f"[{self._get_timestamp()}] Print job completed: {os.path.basename(image_path)}")
                 
@@ -114,24 +132,37 @@ class PhotoboothHandler(FileSystemEventHandler):
         else:
             print(f"[{self._get_timestamp()}] Cannot trigger processing: files={len(self.new_files)}, queue_empty={self.print_queue.empty()}, is_printing={self.is_printing}")
 
-    def add_to_print_queue(self, image_path, copies):
-        """Add a print job to the queue"""
-        self.print_queue.put((image_path, copies))
+    def get_backlog_depth(self):
+        """Number of jobs waiting behind the batch being rendered
+
+        Counts queued print jobs plus complete batches of new files, leaving
+        out the first 3 new files (the batch in progress).
+        """
+        return self.print_queue.qsize() + len(self.new_files[3:]) // 3
+
+    def add_to_print_queue(self, image_path, copies, quality_tier=None):
+        """Add a print job to the queue, printed with the tier it was rendered at"""
+        if quality_tier is None:
+            quality_tier = self.quality_controller.current_tier()
+        self.print_queue.put((image_path, copies, quality_tier))
         queue_size = self.print_queue.qsize()
         if queue_size > 1:
             print(f"[{self._get_timestamp()}] Added to print queue (position {queue_size})")
         else:
             print(f"[{self._get_timestamp()}] Added to print queue (processing now)")
 
-    def print_image(self, image_path, copies=1):
+    def print_image(self, image_path, copies=1, quality_tier=None):
         """Add image to print queue instead of printing directly"""
         if copies > 0:
-            self.add_to_print_queue(image_path, copies)
+            self.add_to_print_queue(image_path, copies, quality_tier)
         else:
             print(f"[{self._get_timestamp()}] Skipping print (0 copies requested)")
 
-    def print_image_direct(self, image_path):
+    def print_image_direct(self, image_path, quality_tier=None):
         """Direct printing method (renamed from print_image)"""
+        if quality_tier is None:
+            quality_tier = self.quality_controller.current_tier()
+        
         try:
             # Get the default printer
             printer_name = win32print.GetDefaultPrinter()
@@ -140,9 +171,14 @@ class PhotoboothHandler(FileSystemEventHandler):
             # Open the image
             img = Image.open(image_path)
             
+            # Read the collage's own profile before resizing (sRGB if untagged)
+            source_key, source_profile = color_management.get_source_profile(img)
+            
             # Create the DC for printing
             hdc = win32ui.CreateDC()
             hdc.CreatePrinterDC(printer_name)
+            printer_key, printer_profile = color_management.get_printer_profile(
+                printer_name, hdc.GetSafeHdc(), self.printer_profile_path)
             
             # Start printing
             hdc.StartDoc(image_path)
@@ -160,8 +196,20 @@ class PhotoboothHandler(FileSystemEventHandler):
             scaled_width = int(physical_width * scale_factor)
             scaled_height = int(physical_height * scale_factor)
             
+            # Under load, let the JPEG decoder downscale (never below the print size)
+            if quality_tier['draft_scale']:
+                img.draft('RGB', (scaled_width * quality_tier['draft_scale'], scaled_height * quality_tier['draft_scale']))
+            
+            # Convert to the printer profile at whichever size is smaller, so the
+            # color transform touches as few pixels as possible
+            convert_first = scaled_width * scaled_height > img.width * img.height
+            if convert_first:
+                img = color_management.convert_to_printer(img, printer_key, printer_profile, source_key, source_profile)
+            
             # Actually resize the image to the scaled dimensions to prevent stretching
-            img_resized = img.resize((scaled_width, scaled_height), Image.Resampling.LANCZOS)
+            img_resized = img.resize((scaled_width, scaled_height), quality_tier['resample'])
+            if not convert_first:
+                img_resized = color_management.convert_to_printer(img_resized, printer_key, printer_profile, source_key, source_profile)
             
             # Center the scaled image within the physical page
             x_offset = -margin_left + (physical_width - scaled_width) // 2
@@ -173,6 +221,7 @@ class PhotoboothHandler(FileSystemEventHandler):
             print(f"[{self._get_timestamp()}] Resized image size: {scaled_width}x{scaled_height}")
             print(f"[{self._get_timestamp()}] Offsets: x={x_offset}, y={y_offset}")
             print(f"[{self._get_timestamp()}] Margins: left={margin_left}, top={margin_top}")
+            print(f"[{self._get_timestamp()}] Printer color profile: {'applied' if printer_profile is not None else 'none (sending sRGB)'}")
             
             # Print the resized image
             dib = ImageWin.Dib(img_resized)
@@ -251,24 +300,65 @@ class PhotoboothHandler(FileSystemEventHandler):
                     else:
                         print(f"[{self._get_timestamp()}] Print system busy - batch will be processed later")
 
+    def _render_collage(self, creator):
+        """Render and save the full-quality collage, recording how long it took"""
+        render_start = time.perf_counter()
+        output_path = creator.create_side_by_side_collage()
+        self.quality_controller.record_latency('render', time.perf_counter() - render_start)
+        return output_path
+
     def process_files(self):
         try:
             print(f"[{self._get_timestamp()}] Creating collage...")
             
             # Fix the import path
-            creator = CollageCreator(self.new_files[:3])  # Take exactly 3 files
-            output_path = creator.create_side_by_side_collage()
-            
-            print(f"[{self._get_timestamp()}] Successfully created collage: {os.path.basename(output_path)}")
+            quality_tier = self.quality_controller.update(self.get_backlog_depth())
+            creator = CollageCreator(self.new_files[:3], quality_tier)  # Take exactly 3 files
             
-            # Ask user for number of copies for this specific collage
-            copies_for_this_collage = self.get_copies_for_collage()
+            if self.show_preview:
+                # Show a low-res preview straight away, then render the full collage
+                # in the background while the operator picks the copy count
+                try:
+                    preview_path = creator.create_preview()
+                    print(f"[{self._get_timestamp()}] Preview ready: {preview_path}")
+                except Exception as e:
+                    print(f"[{self._get_timestamp()}] Could not create preview: {str(e)}")
+                
+                render_result = {}
+                
+                def render_collage():
+                    try:
+                        render_result['output_path'] = self._render_collage(creator)
+                    except Exception as e:
+                        render_result['error'] = e
+                
+                render_thread = threading.Thread(target=render_collage, daemon=True)
+                render_thread.start()
+                
+                # Ask user for number of copies for this specific collage; a render
+                # failure is only reported once the full collage has finished
+                copies_for_this_collage = self.get_copies_for_collage("PREVIEW READY - full collage still rendering...")
+                
+                # Wait for the full-quality render to finish before queueing it
+                render_thread.join()
+                if 'error' in render_result:
+                    raise render_result['error']
+                output_path = render_result['output_path']
+                
+                print(f"[{self._get_timestamp()}] Successfully created collage: {os.path.basename(output_path)}")
+            else:
+                output_path = self._render_collage(creator)
+                
+                print(f"[{self._get_timestamp()}] Successfully created collage: {os.path.basename(output_path)}")
+                
+                # Ask user for number of copies for this specific collage
+                copies_for_this_collage = self.get_copies_for_collage()
             
             if copies_for_this_collage == 0:
                 print(f"[{self._get_timestamp()}] Skipping printing (0 copies requested)")
             else:
                 print(f"[{self._get_timestamp()}] Adding {copies_for_this_collage} cop{'y' if copies_for_this_collage == 1 else 'ies'} to print queue...")
-                self.print_image(output_path, copies_for_this_collage)
+                self.print_image(output_path, copies_for_this_collage, quality_tier)
             
         except Exception as e:
             print(f"[{self._get_timestamp()}] ERROR: Failed to process images")
@@ -0,0 +1,80 @@
+from PIL import Image
+from collections import deque
+from datetime import datetime
+import threading
+
+# Quality tiers, best first. 'full' matches the original output (Pillow's
+# default JPEG quality 75 with 4:2:0). Every tier must still be good enough to print:
+#   resample     - filter used when resizing photos and the print image
+#   draft_scale  - decode JPEGs at no less than this multiple of the target
+#                  size (None = full-resolution decode)
+#   quality      - JPEG quality used when saving the collage
+#   subsampling  - JPEG chroma subsampling (0 = 4:4:4, 2 = 4:2:0)
+QUALITY_TIERS = [
+    {'name': 'full', 'resample': Image.LANCZOS, 'draft_scale': None, 'quality': 75, 'subsampling': 2},
+    {'name': 'balanced', 'resample': Image.BICUBIC, 'draft_scale': 2, 'quality': 72, 'subsampling': 2},
+    {'name': 'fast', 'resample': Image.BILINEAR, 'draft_scale': 1, 'quality': 68, 'subsampling': 2},
+]
+
+
+class QualityController:
+    """Pick a render quality tier from the backlog and recent stage latencies
+
+    Steps down one tier at a time while the backlog would take longer than
+    latency_target seconds to clear, steps back up once it is comfortably
+    under target, and returns straight to full quality when the backlog is
+    empty. Never goes below floor_tier (the lowest print-quality tier).
+    Meant to be updated once per batch, with the same tier used to render
+    and print it.
+    """
+
+    def __init__(self, latency_target=20.0, floor_tier=len(QUALITY_TIERS) - 1, window=5):
+        self.latency_target = latency_target  # seconds to clear the whole backlog
+        self.floor_tier = max(0, min(floor_tier, len(QUALITY_TIERS) - 1))
+        self.step_up_ratio = 0.5  # Only step up when well under target, to avoid flapping
+        self.tier_index = 0
+        self.stage_latencies = {}
+        self.window = window
+        self.lock = threading.Lock()
+
+    def _get_timestamp(self):
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def record_latency(self, stage, seconds):
+        """Record how long one run of a stage (e.g. 'render', 'print') took"""
+        with self.lock:
+            if stage not in self.stage_latencies:
+                self.stage_latencies[stage] = deque(maxlen=self.window)
+            self.stage_latencies[stage].append(seconds)
+
+    def estimated_job_time(self):
+        """Average time for one batch to go through every recorded stage"""
+        with self.lock:
+            return sum(sum(times) / len(times) for times in self.stage_latencies.values() if times)
+
+    def update(self, queue_depth):
+        """Re-evaluate the tier for the current backlog and return its settings"""
+        job_time = self.estimated_job_time()
+        backlog_time = job_time * queue_depth
+
+        with self.lock:
+            new_index = self.tier_index
+            if queue_depth <= 0:
+                new_index = 0
+            elif backlog_time > self.latency_target:
+                new_index = min(self.tier_index + 1, self.floor_tier)
+            elif backlog_time < self.latency_target * self.step_up_ratio:
+                new_index = max(self.tier_index - 1, 0)
+
+            if new_index != self.tier_index:
+                old_name = QUALITY_TIERS[self.tier_index]['name']
+                self.tier_index = new_index
+                print(f"[{self._get_timestamp()}] Render quality: {old_name} -> {QUALITY_TIERS[new_index]['name']} "
+                      f"(backlog {queue_depth} jobs, ~{backlog_time:.1f}s estimated, target {self.latency_target:.1f}s)")
+
+            return QUALITY_TIERS[self.tier_index]
+
+    def current_tier(self):
+        """Return the settings of the tier currently in use"""
+        with self.lock:
+            return QUALITY_TIERS[self.tier_index]